@@ -1,10 +1,11 @@
 import flet as ft
 import asyncio
+import atexit
 import datetime
-import json
+import orjson
 import os
-import requests
-import threading
+import httpx
+import time
 import uuid
 import datetime
 import opik
@@ -33,6 +34,9 @@ load_dotenv(dotenv_path=ENV_PATH)
 N8N_WEBHOOK = os.getenv("N8N_WEBHOOK")   # Unified webhook for state + chat
 OPK_API_KEY = os.getenv("OPK_API_KEY")   # Opik API key
 
+# Webhook bodies are pre-serialized with orjson, so the content type is set by hand
+JSON_HEADERS = {"Content-Type": "application/json"}
+
 # 👇 Debug: check if the variables are actually loaded
 print("Webhook URL from env:", N8N_WEBHOOK)
 print("Opik API KEY from env:", OPK_API_KEY)
@@ -74,6 +78,44 @@ class ConversationTracker:
 tracker = ConversationTracker()
 
 
+# Wake-up sync sent 10s after start unless the user interacts first: (message, delay, event_type)
+STARTUP_WAKEUP = ("empty", 10, "wakeup_event")
+
+
+# --- CHAT BUBBLES ---
+# Shared style objects, built once instead of per message
+USER_ALIGN = ft.alignment.Alignment(1, 0)     # right-center
+AGENT_ALIGN = ft.alignment.Alignment(-1, 0)   # left-center
+AGENT_BORDER = ft.Border.all(1, "#FFE5D9")
+
+
+def make_bubble(text, side="agent"):
+    """Build a chat bubble: "user" is right-aligned and tinted, "agent" is left-aligned with a border."""
+    if side == "user":
+        return ft.Container(
+            content=ft.Text(text, color="black"),
+            alignment=USER_ALIGN,
+            padding=12,
+            bgcolor="#FFE5D9",
+            border_radius=15,
+        )
+    return ft.Container(
+        content=ft.Text(text),
+        alignment=AGENT_ALIGN,
+        padding=12,
+        bgcolor="white",
+        border_radius=15,
+        border=AGENT_BORDER,
+    )
+
+
+def show_unreachable(bubble):
+    """Turn a pending agent bubble into the small red error notice."""
+    bubble.content.value = "Agent unreachable."
+    bubble.content.color = "red"
+    bubble.content.size = 10
+
+
 # --- APP LOGIC CLASS ---
 class AquitariApp:
     def __init__(self, page, chat_history, focus_gauge, chill_gauge):
@@ -83,56 +125,111 @@ class AquitariApp:
         self.focus_gauge = focus_gauge
         self.chill_gauge = chill_gauge
 
+        # One pooled async HTTP client for every webhook call (keep-alive + HTTP/2, no per-call handshake)
+        self.client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=4),
+        )
+
+        # State changes are buffered in memory and flushed to disk by a background task
+        self._state_dirty = False
         # Load saved state from local JSON file (or initialize defaults if none exists)
         self.load_local_data()
         # Check if a new day has started and reset spending/budget health if needed
         self.check_new_day()
-        # Schedule a delayed wake-up sync task when the app starts
-        self.wakeup_task = asyncio.create_task(self.delayed_wakeup(event_type="wakeup_event"))
-        # Track debounce sync
-        self.debounce_task = None
+        # Keep the spending log open and buffered; _flush_loop flushes it once per second
+        self._spend_fp = open(SPENDING_LOG, "a", buffering=8192, encoding="utf-8")
+        atexit.register(lambda: self._spend_fp.close())
+        # Flush buffered state once per second, and one last time on exit
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        atexit.register(self._flush_state)
+        # Hash of the last state payload the webhook accepted (identical re-sends are skipped)
+        self._last_payload_hash = None
         # Track if app is in sleep mode
         self.sleep_mode = False
-
-    async def delayed_wakeup(self,event_type="state_update"):
-        # Wait for 10 seconds before sending state to n8n if no user interaction
-        await asyncio.sleep(10)
-        # Only send if not already in sleep mode
-        if not self.sleep_mode:
-            self.sync_state_to_n8n(message="empty",event_type=event_type)   # Send one state snapshot
-            self.sleep_mode = True                    # Enter sleep mode after one sync
+        # One long-lived worker fires every debounced sync (start-up wake-up, state updates, post-chat idle):
+        # interactions only move the timestamp / replace or drop the pending sync, no task is re-created
+        self._last_interaction = asyncio.get_running_loop().time()
+        self._pending_sync = STARTUP_WAKEUP   # wake-up sync 10s after start if the user stays idle
+        self._sync_wanted = asyncio.Event()
+        self._sync_wanted.set()
+        self._debounce_task = asyncio.create_task(self._debounce_worker())
+        # Single-flight state sync: at most one POST in flight, later requests coalesce into one re-run
+        self._sync_inflight = None
+        self._sync_next = None
 
     def schedule_sync(self, message="empty", delay=15,event_type="wakeup_event"):
         # Schedule a sync after short inactivity (debounce)
         if self.sleep_mode:
             return
-        # Cancel any pending debounce task (reset timer if user keeps interacting)
-        if self.debounce_task and not self.debounce_task.done():
-            self.debounce_task.cancel()
-        # Schedule a new debounce sync
-        self.debounce_task = asyncio.create_task(self._debounced_sync(message, delay,event_type))
-
-    async def _debounced_sync(self, message, delay,event_type):
-        # Wait for inactivity before firing sync
-        await asyncio.sleep(delay)
-        self.sync_state_to_n8n(message=message,event_type=event_type)
-        self.sleep_mode = True   # After one sync, enter sleep mode
+        self.arm_sync(message, delay, event_type)
+
+    def arm_sync(self, message="empty", delay=15, event_type="wakeup_event"):
+        # Replace the pending sync and restart its inactivity window (the worker re-sleeps, no cancel)
+        self._last_interaction = asyncio.get_running_loop().time()
+        self._pending_sync = (message, delay, event_type)
+        self._sync_wanted.set()
+
+    async def _debounce_worker(self):
+        # Sleep out the remaining inactivity window; if activity moved it meanwhile, sleep the new remainder
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._sync_wanted.wait()
+            message, delay, event_type = self._pending_sync
+            remaining = delay - (loop.time() - self._last_interaction)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+                continue
+            self._sync_wanted.clear()
+            # Like the old delayed wake-up: the start-up sync only goes out if nothing put the app to sleep
+            if self._pending_sync is STARTUP_WAKEUP and self.sleep_mode:
+                continue
+            self._request_sync(message, event_type)
+
+    def _request_sync(self, message, event_type):
+        # Remember the latest request; start a sync only if none is in flight
+        self._sync_next = (message, event_type)
+        if self._sync_inflight is None or self._sync_inflight.done():
+            self._sync_inflight = asyncio.create_task(self._sync_runner())
+
+    async def _sync_runner(self):
+        # Run syncs back to back until no newer request arrived while the last one was in flight
+        while self._sync_next is not None:
+            message, event_type = self._sync_next
+            self._sync_next = None
+            await self.sync_state_to_n8n(message=message,event_type=event_type)
+            self.sleep_mode = True   # After one sync, enter sleep mode
 
     def user_interacted(self):
-        # Cancel delayed wake-up if user interacts before it fires
-        if self.wakeup_task and not self.wakeup_task.done():
-            self.wakeup_task.cancel()
+        # Activity pushes back any pending sync, and cancels a pending wake-up (start-up or post-chat idle):
+        # the caller re-arms whatever sync it needs after the interaction
+        self._last_interaction = asyncio.get_running_loop().time()
+        if self._pending_sync is not None and self._pending_sync[2] == "wakeup_event":
+            self._pending_sync = None
+            self._sync_wanted.clear()
         # Wake up if app was in sleep mode
         if self.sleep_mode:
             self.sleep_mode = False
             # Instead of sending immediately, schedule a sync with debounce
            # self.schedule_sync(message="empty", delay=10,event_type="state_update")
 
+    async def close(self):
+        # Stop the background tasks first, so nothing flushes, syncs or posts on a closed client
+        tasks = [t for t in (self._flush_task, self._debounce_task, self._sync_inflight) if t is not None and not t.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Persist pending state and spending lines, then release the pooled webhook connections
+        self._flush_state()
+        self._spend_fp.close()
+        await self.client.aclose()
+
     def load_local_data(self):
         # Load state from file if it exists, otherwise initialize defaults
         if os.path.exists(STATE_FILE):
-            with open(STATE_FILE, "r") as f:
-                self.data = json.load(f)
+            with open(STATE_FILE, "rb") as f:
+                self.data = orjson.loads(f.read())
             # Ensure new keys exist even if old file doesn't have them
             if "focus_level" not in self.data:
                 self.data["focus_level"] = 0.5
@@ -140,12 +237,15 @@ class AquitariApp:
                 self.data["chill_level"] = 0.5
             if "budget_health" not in self.data:
                 self.data["budget_health"] = 1.0
+            # Migrate legacy ISO-string timestamps to a unix epoch float
+            if isinstance(self.data.get("last_activity"), str):
+                self.data["last_activity"] = datetime.datetime.fromisoformat(self.data["last_activity"]).timestamp()
         else:
             self.data = {
                 "daily_budget": 0.0,
                 "total_spent": 0.0,
                 "sleep_hours": 8.0,
-                "last_activity": datetime.datetime.now().isoformat(),
+                "last_activity": time.time(),
                 "is_new_day": True,
                 "focus_level": 0.5,
                 "chill_level": 0.5,
@@ -153,55 +253,79 @@ class AquitariApp:
             }
 
     def save_local_data(self):
-        # Update last activity timestamp and save state to file
-        self.data["last_activity"] = datetime.datetime.now().isoformat()
-        with open(STATE_FILE, "w") as f:
-            json.dump(self.data, f)
+        # Mark state for the background flush; the timestamp is taken there, once per actual write
+        self._state_dirty = True
+
+    def _flush_state(self):
+        # Write pending state atomically (temp file + os.replace) so a crash never leaves a half-written file
+        if not self._state_dirty:
+            return
+        self.data["last_activity"] = time.time()
+        tmp = STATE_FILE + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps(self.data))
+        os.replace(tmp, STATE_FILE)
+        self._state_dirty = False
+
+    async def _flush_loop(self):
+        # Persist buffered state changes and spending lines at most once per second
+        while True:
+            await asyncio.sleep(1)
+            self._flush_state()
+            self._spend_fp.flush()
 
     def check_new_day(self):
         # Determine if a new day has started based on last activity
-        last_time = datetime.datetime.fromisoformat(self.data["last_activity"])
-        now = datetime.datetime.now()
-        time_diff = (now - last_time).total_seconds() / 3600
+        last_ts = self.data["last_activity"]
+        now_ts = time.time()
+        now = datetime.datetime.fromtimestamp(now_ts)   # converted once, reused for hour and date
+        time_diff = (now_ts - last_ts) / 3600.0
         # Reset spending if it's a new day or early morning after inactivity
-        if (time_diff > 2 and now.hour < 6) or (last_time.date() < now.date()):
+        if (time_diff > 2 and now.hour < 6) or (datetime.date.fromtimestamp(last_ts) < now.date()):
             self.data["total_spent"] = 0.0
             self.data["budget_health"] = 1.0
             self.data["is_new_day"] = True
+            # Runs at start-up, before the spending log is opened for appending
             if os.path.exists(SPENDING_LOG):
                 os.remove(SPENDING_LOG)
             self.save_local_data()
 
-    def sync_state_to_n8n(self, message="empty", event_type="state_update"):
-    
+    def _state_body(self, message, event_type=None):
+        # Build the webhook body: message + current state snapshot, serialized once with orjson
         payload = {
-        "thread_id": SESSION_THREAD_ID,  # ✅ Always the same for this run
-        "chat": {
-            "message": message,
-            "budget": self.data["daily_budget"],
-            "spent": self.data["total_spent"],
-            "sleep": self.data["sleep_hours"],
-            "new_day": self.data.get("is_new_day", False),
-            "focus_level": self.data.get("focus_level", 0.5),
-            "chill_level": self.data.get("chill_level", 0.5),
-            "budget_health": self.data.get("budget_health", 1.0),
-            "event_type": event_type,  # ✅ Added to mark this as a wake-up/state sync
+            "thread_id": SESSION_THREAD_ID,  # ✅ Always the same for this run
+            "chat": {
+                "message": message,
+                "budget": self.data["daily_budget"],
+                "spent": self.data["total_spent"],
+                "sleep": self.data["sleep_hours"],
+                "new_day": self.data.get("is_new_day", False),
+                "focus_level": self.data.get("focus_level", 0.5),
+                "chill_level": self.data.get("chill_level", 0.5),
+                "budget_health": self.data.get("budget_health", 1.0),
+            }
         }
-    }
+        if event_type is not None:
+            payload["chat"]["event_type"] = event_type  # ✅ Marks this as a wake-up/state sync
+        return orjson.dumps(payload)
+
+    async def sync_state_to_n8n(self, message="empty", event_type="state_update"):
+        # Keep the state file consistent with what the webhook is about to see
+        self._flush_state()
+        body = self._state_body(message, event_type)
+        # Nothing changed since the last successful state sync: skip the POST (chat messages always go out)
+        payload_hash = hash(body)
+        if message == "empty" and payload_hash == self._last_payload_hash:
+            return
 
         try:
-            placeholder = ft.Container(
-                content=ft.Text("..."),
-                alignment=ft.alignment.Alignment(-1, 0),
-                padding=12,
-                bgcolor="white",
-                border_radius=15,
-                border=ft.Border.all(1, "#FFE5D9"),
-            )
+            placeholder = make_bubble("...")
             self.chat_history.controls.append(placeholder)
             self.page.update()
 
-            res = requests.post(N8N_WEBHOOK, json=payload, timeout=60)
+            res = await self.client.post(N8N_WEBHOOK, content=body, headers=JSON_HEADERS)
+            if res.is_success:
+                self._last_payload_hash = payload_hash
 
             try:
                 data = res.json()
@@ -227,7 +351,7 @@ class AquitariApp:
             if not parsed.get("reply"):
                 parsed["reply"] = "I didn’t get it, please try again."
 
-            placeholder.content = ft.Text(parsed["reply"])
+            placeholder.content.value = parsed["reply"]
 
             # ✅ Log this user ↔ agent exchange to Opik under the current chat thread
             tracker.chat_turn(message, parsed["reply"])
@@ -246,7 +370,7 @@ class AquitariApp:
             self.sleep_mode = True
 
         except Exception as e:
-            placeholder.content = ft.Text("Agent unreachable.", color="red", size=10)
+            show_unreachable(placeholder)
             self.page.update()
             print("Sync error:", e)
 
@@ -255,7 +379,7 @@ class AquitariApp:
 
 
 # --- MAIN FUNCTION ---
-def main(page: ft.Page):
+async def main(page: ft.Page):
     # --- CHAT INTERFACE ---
     chat_history = ft.ListView(expand=True, spacing=10, auto_scroll=True)
 
@@ -293,10 +417,16 @@ def main(page: ft.Page):
     # Initialize app logic with UI references
     app_logic = AquitariApp(page, chat_history, focus_gauge, chill_gauge)
 
+    async def on_close(e):
+        # Session ended: flush state and close the shared HTTP client
+        await app_logic.close()
+
+    page.on_close = on_close
+
     # --- INPUTS ---
     sleep_slider = ft.Slider(
         min=4, max=10, divisions=6, label="{value}h", value=app_logic.data["sleep_hours"],
-        active_color="#A8C6BC", on_change=lambda e: update_sleep(e),
+        active_color="#A8C6BC",
     )
     budget_input = ft.TextField(label="Daily Budget", value=str(app_logic.data["daily_budget"]),
                                 prefix=ft.Text("$ "), width=140, border_radius=10)
@@ -304,15 +434,22 @@ def main(page: ft.Page):
     spending_input = ft.TextField(label="Actual Spending", prefix=ft.Text("$ "), width=140, border_radius=10)
 
     # --- LOGIC HANDLERS ---
-    def update_sleep(e):
-        # Update local state when user moves sleep slider
+    async def update_sleep(e):
+        # Update local state and gauge while the user drags the sleep slider (no sync per frame)
         app_logic.data["sleep_hours"] = float(sleep_slider.value)
         sleep_gauge.controls[0].controls[0].value = sleep_slider.value / 10
+        page.update()
+
+    async def commit_sleep(e):
+        # Slider released: one wake-up + debounced sync per drag gesture
         app_logic.user_interacted()                 # Wake up if in sleep mode
         app_logic.schedule_sync(message="empty",event_type="state_update")    # Debounced sync (fires once after inactivity)
-        page.update()
 
-    def set_budget(e):
+    # Async handlers are attached directly (a lambda wrapper would never await the coroutine)
+    sleep_slider.on_change = update_sleep
+    sleep_slider.on_change_end = commit_sleep
+
+    async def set_budget(e):
         try:
             # Update daily budget from input field
             app_logic.data["daily_budget"] = float(budget_input.value or 0)
@@ -325,13 +462,12 @@ def main(page: ft.Page):
         except:
             pass
 
-    def add_spending(e):
+    async def add_spending(e):
         try:
             # Add spending entry and recalc budget health
             val = float(spending_input.value or 0)
             app_logic.data["total_spent"] += val
-            with open(SPENDING_LOG, "a") as f:
-                f.write(f"{datetime.datetime.now()}: ${val}\n")
+            app_logic._spend_fp.write(f"{time.time():.3f}: ${val}\n")   # epoch seconds
             if app_logic.data["daily_budget"] > 0:
                 health = 1 - (app_logic.data["total_spent"] / app_logic.data["daily_budget"])
                 app_logic.data["budget_health"] = max(0.0, min(1.0, health))
@@ -347,57 +483,32 @@ def main(page: ft.Page):
     # --- CHAT INTERFACE ---
 
 
-    def on_message_send(e):
+    async def on_message_send(e):
         # If input field is empty, do nothing
         if not chat_input.value:
             return
         user_msg = chat_input.value
 
         # Display user message in chat history (right-aligned bubble)
-        chat_history.controls.append(
-            ft.Container(
-                content=ft.Text(user_msg, color="black"),
-                alignment=ft.alignment.Alignment(1, 0),  # right-center
-                padding=12,
-                bgcolor="#FFE5D9",
-                border_radius=15
-            )
-        )
+        chat_history.controls.append(make_bubble(user_msg, "user"))
         chat_input.value = ""   # Clear input field after sending
         page.update()
         app_logic.user_interacted()   # Wake up if app was in sleep mode
 
         try:
-            # Build payload with user message + current state snapshot
-            payload = {
-                "thread_id": SESSION_THREAD_ID,
-                "chat": {
-                    "message": user_msg,
-                    "budget": app_logic.data["daily_budget"],
-                    "spent": app_logic.data["total_spent"],
-                    "sleep": app_logic.data["sleep_hours"],
-                    "new_day": app_logic.data.get("is_new_day", False),
-                    "focus_level": app_logic.data.get("focus_level", 0.5),
-                    "chill_level": app_logic.data.get("chill_level", 0.5),
-                    "budget_health": app_logic.data.get("budget_health", 1.0),
-                    # ✅ Always the same for this run
-                }
-            }
+            # Build body with user message + current state snapshot
+            body = app_logic._state_body(user_msg)
 
             # Show placeholder bubble with "..." while agent is thinking
-            placeholder = ft.Container(
-                content=ft.Text("..."),
-                alignment=ft.alignment.Alignment(-1, 0),  # left-center
-                padding=12,
-                bgcolor="white",
-                border_radius=15,
-                border=ft.Border.all(1, "#FFE5D9"),
-            )
+            placeholder = make_bubble("...")
             chat_history.controls.append(placeholder)
             page.update()
 
             # Send chat message immediately
-            res = requests.post(N8N_WEBHOOK, json=payload, timeout=70)
+            # Chat replies get a longer read timeout; keep the client's short connect timeout
+            res = await app_logic.client.post(
+                N8N_WEBHOOK, content=body, headers=JSON_HEADERS, timeout=httpx.Timeout(70.0, connect=5.0)
+            )
 
             # Safely parse response
             try:
@@ -425,7 +536,7 @@ def main(page: ft.Page):
                 parsed["reply"] = "I didn’t get it, please try again."
 
             # ✅ Update the placeholder bubble with the actual reply
-            placeholder.content = ft.Text(parsed["reply"])
+            placeholder.content.value = parsed["reply"]
 
             # ✅ Log this user ↔ agent exchange to Opik under the current chat thread
             tracker.chat_turn(user_msg, parsed["reply"])
@@ -439,18 +550,10 @@ def main(page: ft.Page):
                 app_logic.data["chill_level"] = parsed["chill"]
 
             # 🔄 Schedule idle sync (only once, no double send)
-            if hasattr(app_logic, "idle_timer") and app_logic.idle_timer:
-                app_logic.idle_timer.cancel()
-
-            def idle_sync():
-                app_logic.sync_state_to_n8n(message="empty",event_type="wakeup_event")
-                app_logic.sleep_mode = True
-
-            app_logic.idle_timer = threading.Timer(20.0, idle_sync)
-            app_logic.idle_timer.start()
+            app_logic.arm_sync(message="empty", delay=20.0, event_type="wakeup_event")
 
         except Exception as e:
-            placeholder.content = ft.Text("Agent unreachable.", color="red", size=10)
+            show_unreachable(placeholder)
             print("Sync error:", e)
 
         page.update()
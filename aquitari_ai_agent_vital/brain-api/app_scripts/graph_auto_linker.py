@@ -16,20 +16,29 @@ Usage:
     - Place your graph JSON file at the desired location.
     - Update the GRAPH_PATH variable below to point to your file.
     - Run the script: python graph_auto_linker.py
-    - The script will update the graph with inferred edges and overwrite the file.
+      (or import it and call run(graph_path) to keep the model loaded between runs)
+    - The script will update the graph with inferred edges and overwrite the file
+      (the file is left untouched when no new edge was inferred).
 
 Notes:
     - Threshold controls how strict the similarity check is (default: 0.35).
     - Webhook URL must be reachable; otherwise, fallback relation is used.
 """
 
-import json
+import hashlib
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import shelve
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer, util
+from sklearn.metrics.pairwise import linear_kernel
+from sentence_transformers import SentenceTransformer
 
 # ✅ Get the root folder of brain-api (we move up from app_scripts to its parent)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -37,8 +46,15 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # 🔧 Path to your graph JSON file inside brain-api/data
 GRAPH_PATH = os.path.join(BASE_DIR, "data", "brain_graph.json")
 
-# Load embedding model once (lightweight, fast)
-EMBED_MODEL = SentenceTransformer("all-MiniLM-L6-v2")
+# 🔧 On-disk cache of node embeddings, keyed by a hash of model name + node text
+EMBED_CACHE_PATH = os.path.join(BASE_DIR, "data", "embedding_cache")
+
+# Load embedding model once (lightweight, fast); on a GPU run it in fp16 for half the memory traffic
+EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+EMBED_MODEL = SentenceTransformer(EMBED_MODEL_NAME, device=DEVICE)
+if DEVICE == "cuda":
+    EMBED_MODEL.half()
 
 # ✅ Load environment variables from the project-relative .env file
 ENV_PATH = os.path.join(BASE_DIR, ".env")
@@ -49,52 +65,85 @@ WEBHOOK_URL = os.getenv("N8N_WEBHOOK2")   # Unified webhook
 # 👇 Debug: check if the variables are actually loaded
 print("Webhook URL from env:", WEBHOOK_URL)
 
+# Concurrent webhook calls when classifying candidate pairs
+AGENT_WORKERS = 16
+
+# Shared keep-alive session: one TCP/TLS handshake per pooled connection, not per candidate pair
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=AGENT_WORKERS,
+    max_retries=Retry(total=2, backoff_factor=0.1),
+)
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+
+# Relations already returned by the agent, keyed by (source, target, source_desc, target_desc);
+# fallbacks are never cached
+_RELATION_CACHE = {}
+
 def load_graph(filename):
     """Load the graph JSON file."""
-    with open(filename, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(filename, "rb") as f:
+        return orjson.loads(f.read())
 
 
 def save_graph(graph, filename):
-    """Save the updated graph back to JSON."""
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(graph, f, indent=2, ensure_ascii=False)
+    """Save the updated graph back to JSON (temp file + os.replace, never half-written)."""
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(graph, option=orjson.OPT_INDENT_2))
+    os.replace(tmp, filename)
 
 
 def build_text_representation(node):
     """Combine node id and attributes into a text string for similarity."""
-    parts = [node.get("id", ""), node.get("description", "")]
     attrs = node.get("attributes", {})
-    for k, v in attrs.items():
-        if isinstance(v, list):
-            parts.extend(v)
-        else:
-            parts.append(str(v))
-    return " ".join(parts)
+    return " ".join([
+        node.get("id", ""),
+        node.get("description", ""),
+        *(s for v in attrs.values() for s in (v if isinstance(v, list) else [str(v)])),
+    ])
+
+
+def edge_keys(edges):
+    """Build a set of (source, target, relation) keys for O(1) edge-exists checks."""
+    return {(e.get("source"), e.get("target"), e.get("relation")) for e in edges}
 
 
-def edge_exists(edges, source, target, relation):
-    """Check if an edge already exists in the graph."""
-    return any(
-        e.get("source") == source and e.get("target") == target and e.get("relation") == relation
-        for e in edges
-    )
+def candidate_pairs(similarity_matrix, threshold):
+    """Yield (i, j, similarity) for every pair i < j at or above threshold, selected in one vectorized pass."""
+    rows, cols = np.triu_indices(similarity_matrix.shape[0], k=1)
+    sims = similarity_matrix[rows, cols]
+    mask = sims >= threshold
+    return zip(rows[mask].tolist(), cols[mask].tolist(), sims[mask].tolist())
 
 
 def clean_agent_output(text: str) -> str:
     """Remove backticks, language hints, and whitespace from agent output."""
-    # Strip triple backticks and language markers like ```json
-    text = text.strip()
-    if text.startswith("```"):
-        text = text.strip("`")
-    # Remove leading 'json' or similar markers
-    if text.lower().startswith("json"):
+    # Strip triple backticks and language markers like ```json (plain string ops: linear on any reply)
+    text = text.strip().strip("`").strip()
+    if text[:4].lower() == "json":
         text = text[4:].strip()
     return text
 
 
 def ask_agent_relation(source, target, source_desc, target_desc):
-    """Send candidate pair to webhook and return relation or fallback."""
+    """Send candidate pair to webhook and return relation or fallback (memoized per pair and descriptions)."""
+    # Descriptions are part of the key: an updated node description gets its pairs re-classified
+    key = (source, target, source_desc, target_desc)
+    cached = _RELATION_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    relation = _request_agent_relation(source, target, source_desc, target_desc)
+    if relation != "UNKNOWN_RELATION":
+        _RELATION_CACHE[key] = relation
+    return relation
+
+
+def _request_agent_relation(source, target, source_desc, target_desc):
+    """Ask the relation classifier webhook about one candidate pair."""
     payload = {
         "source": source,
         "target": target,
@@ -103,7 +152,7 @@ def ask_agent_relation(source, target, source_desc, target_desc):
         "target_description": target_desc,
     }
     try:
-        response = requests.post(WEBHOOK_URL, json=payload, timeout=10)
+        response = _SESSION.post(WEBHOOK_URL, json=payload, timeout=10)
 
         # 🔎 Debug: show raw response text
         print(f"🔎 Raw webhook response for {source} ↔ {target}: {response.text}")
@@ -118,7 +167,7 @@ def ask_agent_relation(source, target, source_desc, target_desc):
         if isinstance(data, dict) and "output" in data:
             try:
                 inner_text = clean_agent_output(data["output"])
-                inner = json.loads(inner_text)
+                inner = orjson.loads(inner_text)
                 if "relation" in inner:
                     return inner["relation"]
             except Exception as e:
@@ -128,7 +177,7 @@ def ask_agent_relation(source, target, source_desc, target_desc):
         if isinstance(data, list) and len(data) > 0 and "output" in data[0]:
             try:
                 inner_text = clean_agent_output(data[0]["output"])
-                inner = json.loads(inner_text)
+                inner = orjson.loads(inner_text)
                 if "relation" in inner:
                     return inner["relation"]
             except Exception as e:
@@ -142,76 +191,145 @@ def ask_agent_relation(source, target, source_desc, target_desc):
         return "UNKNOWN_RELATION"
 
 
-def auto_link_tfidf(graph, threshold=0.35):
+def auto_link_tfidf(graph, corpus, ids, threshold=0.35):
     """Baseline keyword similarity using TF-IDF."""
-    nodes = graph.get("nodes", [])
     edges = graph.setdefault("edges", [])
 
-    corpus = [build_text_representation(node) for node in nodes]
-    ids = [node["id"] for node in nodes]
-
-    vectorizer = TfidfVectorizer().fit_transform(corpus)
-    similarity_matrix = cosine_similarity(vectorizer)
+    # TF-IDF rows are already L2-normalized, so cosine similarity is one sparse dot product (float32)
+    vectorizer = TfidfVectorizer(dtype=np.float32).fit_transform(corpus)
+    similarity_matrix = linear_kernel(vectorizer, vectorizer)
 
+    seen = edge_keys(edges)
     new_edges = 0
-    for i in range(len(nodes)):
-        for j in range(i + 1, len(nodes)):
-            sim = similarity_matrix[i][j]
-            if sim >= threshold:
-                if not edge_exists(edges, ids[i], ids[j], "RELATED_TFIDF"):
-                    edge = {
-                        "source": ids[i],
-                        "target": ids[j],
-                        "relation": "RELATED_TFIDF"
-                    }
-                    edges.append(edge)
-                    new_edges += 1
-                    print(f"🟢 [TF-IDF] {ids[i]} ↔ {ids[j]} (similarity={sim:.2f})")
+    for i, j, sim in candidate_pairs(similarity_matrix, threshold):
+        key = (ids[i], ids[j], "RELATED_TFIDF")
+        if key not in seen:
+            seen.add(key)
+            edge = {
+                "source": ids[i],
+                "target": ids[j],
+                "relation": "RELATED_TFIDF"
+            }
+            edges.append(edge)
+            new_edges += 1
+            print(f"🟢 [TF-IDF] {ids[i]} ↔ {ids[j]} (similarity={sim:.2f})")
 
     print(f"📊 TF-IDF edges added: {new_edges}")
     return graph
 
 
-def auto_link_embeddings(graph, threshold=0.35):
+def embed_cache_key(text):
+    """Disk cache key of one node text (model name included, so switching models never reuses vectors)."""
+    return hashlib.sha1(f"{EMBED_MODEL_NAME}\0{text}".encode("utf-8")).hexdigest()
+
+
+def embed_corpus(corpus):
+    """Return unit-length embeddings for corpus, encoding only texts not already in the disk cache."""
+    keys = [embed_cache_key(text) for text in corpus]
+    with shelve.open(EMBED_CACHE_PATH) as cache:
+        missing = [i for i, key in enumerate(keys) if key not in cache]
+        if missing:
+            fresh = EMBED_MODEL.encode(
+                [corpus[i] for i in missing],
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                batch_size=64,
+                show_progress_bar=False,
+            )
+            for i, vector in zip(missing, fresh):
+                cache[keys[i]] = vector.astype(np.float16)   # fp16 on disk: half the size, ample precision
+        vectors = np.stack([cache[key] for key in keys]).astype(np.float32)
+    print(f"🧠 Embeddings: {len(keys) - len(missing)} cached, {len(missing)} encoded")
+
+    embeddings = torch.from_numpy(vectors).to(DEVICE)
+    return embeddings.half() if DEVICE == "cuda" else embeddings
+
+
+def prune_embedding_cache(corpus):
+    """Drop cached embeddings of texts no longer in corpus (edited or deleted nodes)."""
+    keep = {embed_cache_key(text) for text in corpus}
+    with shelve.open(EMBED_CACHE_PATH) as cache:
+        stale = [key for key in cache.keys() if key not in keep]
+        for key in stale:
+            del cache[key]
+        # gdbm keeps freed space until reorganized; other dbm backends have no such call
+        if stale and hasattr(cache.dict, "reorganize"):
+            cache.dict.reorganize()
+    if stale:
+        print(f"🧹 Embedding cache: {len(stale)} stale entries removed")
+
+
+def auto_link_embeddings(graph, corpus, ids, threshold=0.35):
     """Semantic similarity using SentenceTransformer embeddings + agent webhook."""
-    nodes = graph.get("nodes", [])
     edges = graph.setdefault("edges", [])
 
-    corpus = [build_text_representation(node) for node in nodes]
-    ids = [node["id"] for node in nodes]
-
-    embeddings = EMBED_MODEL.encode(corpus, convert_to_tensor=True)
-    similarity_matrix = util.cos_sim(embeddings, embeddings)
-
+    # Descriptions sit alongside ids/corpus, so the pair loop indexes lists instead of re-reading node dicts
+    descs = [node.get("description", "") for node in graph.get("nodes", [])]
+    if len(corpus) < 2:
+        print("📊 Embedding edges added: 0")
+        return graph
+
+    embeddings = embed_corpus(corpus)
+    # Unit-length embeddings: cosine similarity is a single matmul on the model's device
+    similarity_matrix = (embeddings @ embeddings.T).float().cpu().numpy()
+
+    # Ask the agent about all candidate pairs concurrently (each call is one webhook round trip)
+    pairs = list(candidate_pairs(similarity_matrix, threshold))
+    with ThreadPoolExecutor(max_workers=AGENT_WORKERS) as pool:
+        relations = list(pool.map(
+            lambda p: ask_agent_relation(ids[p[0]], ids[p[1]], descs[p[0]], descs[p[1]]),
+            pairs,
+        ))
+
+    seen = edge_keys(edges)
     new_edges = 0
-    for i in range(len(nodes)):
-        for j in range(i + 1, len(nodes)):
-            sim = similarity_matrix[i][j].item()
-            if sim >= threshold:
-                relation = ask_agent_relation(
-                    ids[i], ids[j],
-                    nodes[i].get("description", ""), nodes[j].get("description", "")
-                )
-                if not edge_exists(edges, ids[i], ids[j], relation):
-                    edge = {
-                        "source": ids[i],
-                        "target": ids[j],
-                        "relation": relation
-                    }
-                    edges.append(edge)
-                    new_edges += 1
-                    print(f"🤖 [Embedding] {ids[i]} ↔ {ids[j]} (relation={relation}, similarity={sim:.2f})")
+    for (i, j, sim), relation in zip(pairs, relations):
+        key = (ids[i], ids[j], relation)
+        if key not in seen:
+            seen.add(key)
+            edge = {
+                "source": ids[i],
+                "target": ids[j],
+                "relation": relation
+            }
+            edges.append(edge)
+            new_edges += 1
+            print(f"🤖 [Embedding] {ids[i]} ↔ {ids[j]} (relation={relation}, similarity={sim:.2f})")
 
     print(f"📊 Embedding edges added: {new_edges}")
     return graph
 
 
-if __name__ == "__main__":
-    graph = load_graph(GRAPH_PATH)
+def run(graph_path=GRAPH_PATH):
+    """Enrich the graph file at graph_path in place (entry point for the CLI and the feedback updater)."""
+    graph = load_graph(graph_path)
+    edges_before = len(graph.get("edges", []))
+
+    # Node ids and texts are built once, as parallel tuples shared by both methods
+    nodes = graph.get("nodes", [])
+    ids = tuple(node["id"] for node in nodes)
+    corpus = tuple(build_text_representation(node) for node in nodes)
+
+    # The relation cache outlives a run when the updater calls run() in-process:
+    # forget pairs classified against node descriptions that no longer exist
+    descs = {node["id"]: node.get("description", "") for node in nodes}
+    for key in [k for k in _RELATION_CACHE if descs.get(k[0]) != k[2] or descs.get(k[1]) != k[3]]:
+        del _RELATION_CACHE[key]
 
     # Run both methods
-    graph = auto_link_tfidf(graph, threshold=0.35)
-    graph = auto_link_embeddings(graph, threshold=0.35)
+    graph = auto_link_tfidf(graph, corpus, ids, threshold=0.35)
+    graph = auto_link_embeddings(graph, corpus, ids, threshold=0.35)
+
+    # Only rewrite the file (and wake its watchers) when something was actually added
+    if len(graph["edges"]) > edges_before:
+        save_graph(graph, graph_path)
+        print("✅ Graph updated with enriched relations (TF-IDF + Agent).")
+    else:
+        print("ℹ️ No new relations inferred; graph file left untouched.")
+
+    # Like the relation cache, the embedding cache would otherwise keep every text ever embedded
+    prune_embedding_cache(corpus)
 
-    save_graph(graph, GRAPH_PATH)
-    print("✅ Graph updated with enriched relations (TF-IDF + Agent).")
\ No newline at end of file
+
+if __name__ == "__main__":
+    run()
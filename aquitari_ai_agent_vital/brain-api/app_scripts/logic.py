@@ -3,10 +3,10 @@ AQUITARI REASONING ENGINE - LOGICAL CORE
 ----------------------------------------
 Description:
 This script acts as the 'Neural Map' of the agent. It transforms a static 
-JSON Knowledge Graph into an active reasoning system using NetworkX.
+JSON Knowledge Graph into an active reasoning system of precomputed graph tables.
 
 Capabilities:
-1. Graph Construction: Converts JSON entities and relations into a Directed Graph (DiGraph).
+1. Graph Construction: Converts JSON entities and relations into directed adjacency tables.
 2. Deterministic Diagnosis: Predicts behavioral risks based on biological inputs.
 3. Pathfinding: Automatically detects if a user state leads to 'Safe Mode' triggers.
 4. Explainability: Traces the logic steps taken so the agent can explain its "Why".
@@ -15,12 +15,12 @@ Capabilities:
 File: app/logic.py
 """
 
-import json
+import orjson
 import os
+import pickle
 import logging
-import networkx as nx
-from typing import List, Dict, Any
-from threading import Thread
+from typing import List, Dict, Any, Optional, Set
+from threading import Thread, Timer, Lock
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
@@ -35,11 +35,40 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # 🔧 Path to your graph JSON file inside brain-api/data
 KG_FILE = os.path.join(BASE_DIR, "data", "brain_graph.json")
 
+# ⏱️ Quiet period after the last file event before the graph is reloaded (seconds)
+RELOAD_DEBOUNCE = 0.3
+
+# 🔧 Layout version of the pickled graph snapshot; bump when the precomputed tables change
+SNAPSHOT_FORMAT = 4
+
+
+def _file_stamp(path: str) -> tuple:
+    """(mtime_ns, size) of path: catches rewrites that land within the filesystem's mtime granularity."""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _bfs_edges_depth2(successors: Dict[str, List[str]], start: str) -> List[tuple]:
+    """Breadth-first tree edges from start, at most 2 hops deep (same order as nx.bfs_edges)."""
+    seen = {start}
+    frontier = [start]
+    edges = []
+    for _ in range(2):
+        next_frontier = []
+        for u in frontier:
+            for v in successors.get(u, ()):
+                if v not in seen:
+                    seen.add(v)
+                    edges.append((u, v))
+                    next_frontier.append(v)
+        frontier = next_frontier
+    return edges
+
 
 class AquitariBrain:
     """
     The core reasoning engine for Aquitari. 
-    Uses a Directed Graph (NetworkX) to map how biological states 
+    Uses a directed graph (successor lists built from the JSON) to map how biological states 
     (like low sleep) lead to financial risks and trigger safety protocols.
     """
 
@@ -50,54 +79,135 @@ class AquitariBrain:
         - Starts the file watcher for auto-reload.
         """
         self.kg_path = kg_path
-        self.G = nx.DiGraph()
+        # Pickled tables built from the JSON, reused while the JSON is unchanged
+        # (each API worker process then starts with one unpickle instead of a full rebuild)
+        self.snapshot_path = os.path.splitext(kg_path)[0] + ".pkl"
+        # Bumped on every reload, so callers can tell when cached results went stale
+        self._revision = 0
+        # Read-only lookup tables rebuilt on every load
+        # (safe_mode_ancestors, successors, relations, explain) in ONE attribute: a reload replaces the
+        # tuple with a single assignment, and each request reads it once, so it never mixes two graphs
+        self._tables: tuple = (set(), {}, {}, {})
+        # Stamp of the file the current graph was loaded from (lets the watcher skip no-op events)
+        self._loaded_stamp = None
         self._load_knowledge_graph()
         self._start_file_watcher()
 
     def _load_knowledge_graph(self):
-        """Load the JSON knowledge graph into the NetworkX graph."""
+        """Load the JSON knowledge graph (or its up-to-date snapshot) into the precomputed lookup tables."""
         if not os.path.exists(self.kg_path):
             logger.error(f"CRITICAL: Knowledge Graph file not found at {self.kg_path}")
             return
 
         try:
-            with open(self.kg_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
-            system_id = data.get("system_id", "unknown")
-            version = data.get("metadata", {}).get("version", "0.0")
-            logger.info(f"Loading Brain: {system_id} (v{version})")
-
-            # Clear existing graph to avoid duplicates
-            self.G.clear()
-
-            # Add nodes from JSON
-            for node in data.get("nodes", []):
-                self.G.add_node(
-                    node["id"], 
-                    type=node.get("type"), 
-                    description=node.get("description")
-                )
+            stamp = _file_stamp(self.kg_path)
+            tables = self._load_snapshot(stamp)
+            if tables is None:
+                with open(self.kg_path, "rb") as f:
+                    data = orjson.loads(f.read())
 
-            # Add edges from JSON
-            for edge in data.get("edges", []):
-                self.G.add_edge(
-                    edge["source"], 
-                    edge["target"], 
-                    relation=edge.get("relation")
-                )
+                system_id = data.get("system_id", "unknown")
+                version = data.get("metadata", {}).get("version", "0.0")
+                logger.info(f"Loading Brain: {system_id} (v{version})")
 
-            logger.info(f"Brain Online: {self.G.number_of_nodes()} nodes loaded.")
+                tables = self._build_tables(data)
+                self._save_snapshot(stamp, tables)
+            else:
+                logger.info(f"Loading Brain from snapshot {self.snapshot_path}")
 
-        except json.JSONDecodeError:
+            # Swap everything in at once, so requests never see a half-built graph
+            self._tables = tables
+
+            # New graph, new revision: results computed against the old one are stale
+            self._revision += 1
+            self._loaded_stamp = stamp
+
+            logger.info(f"Brain Online: {len(tables[1])} nodes loaded.")
+
+        except orjson.JSONDecodeError:
             logger.error("CRITICAL: JSON file is corrupted or formatted incorrectly.")
         except Exception as e:
             logger.error(f"Failed to initialize brain: {str(e)}")
 
+    @staticmethod
+    def _build_tables(data: Dict[str, Any]) -> tuple:
+        """Build the precomputed lookup tables (plain dicts) straight from parsed JSON."""
+        nodes = data.get("nodes", [])
+        edges = data.get("edges", [])
+
+        # Successor lists and edge relations (later duplicates overwrite the relation, like DiGraph)
+        successors: Dict[str, List[str]] = {node["id"]: [] for node in nodes}
+        relations: Dict[tuple, Any] = {}
+        for edge in edges:
+            u, v = edge["source"], edge["target"]
+            targets = successors.setdefault(u, [])
+            successors.setdefault(v, [])
+            if (u, v) not in relations:
+                targets.append(v)
+            relations[(u, v)] = edge.get("relation")
+
+        # safe_mode is fixed, so one reverse search answers "does this state reach safe_mode?" for every node
+        safe_mode_ancestors: Set[str] = set()
+        if "safe_mode" in successors:
+            predecessors: Dict[str, List[str]] = {}
+            for u, targets in successors.items():
+                for v in targets:
+                    predecessors.setdefault(v, []).append(u)
+            safe_mode_ancestors.add("safe_mode")
+            stack = ["safe_mode"]
+            while stack:
+                for u in predecessors.get(stack.pop(), ()):
+                    if u not in safe_mode_ancestors:
+                        safe_mode_ancestors.add(u)
+                        stack.append(u)
+
+        # 2-hop reasoning traces for every node with out-edges (others explain to [])
+        explain = {
+            n: [f"{u} --[{relations.get((u, v), 'leads to')}]--> {v}" for u, v in _bfs_edges_depth2(successors, n)]
+            for n, targets in successors.items() if targets
+        }
+
+        return safe_mode_ancestors, successors, relations, explain
+
+    def _load_snapshot(self, stamp: tuple) -> Optional[tuple]:
+        """Returns the pickled tables if the snapshot was built from this exact JSON version, else None."""
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable graph snapshot: {e}")
+            return None
+        if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("source_stamp") != stamp:
+            return None
+        return snapshot["tables"]
+
+    def _save_snapshot(self, stamp: tuple, tables: tuple):
+        """Pickles the freshly built tables next to the JSON (temp file + replace; other workers may read it)."""
+        tmp = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(
+                    {"format": SNAPSHOT_FORMAT, "source_stamp": stamp, "tables": tables},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"Could not write graph snapshot: {e}")
+
+    @property
+    def revision(self) -> int:
+        """Counter bumped on every successful graph load (for caches layered on top of the brain)."""
+        return self._revision
+
     # -------- REASONING METHODS --------
     def diagnose(self, state_id: str) -> Dict[str, Any]:
-        """Analyzes a state and predicts risks and safety triggers."""
-        if state_id not in self.G:
+        """Analyzes a state and predicts risks and safety triggers (dict lookups into the precomputed tables)."""
+        # One read of the tables: a concurrent reload can't hand us parts of two different graphs
+        safe_mode_ancestors, successors, relations, explain = self._tables
+        if state_id not in successors:
             logger.warning(f"Query received for unknown state: {state_id}")
             return {
                 "error": f"State '{state_id}' is not mapped in the Knowledge Graph.", 
@@ -105,46 +215,63 @@ class AquitariBrain:
             }
 
         # Identify direct downstream risks
-        risks = []
-        for successor in self.G.successors(state_id):
-            relation = self.G.edges[state_id, successor].get("relation")
-            risks.append({"risk": successor, "relation": relation})
+        risks = [
+            {"risk": successor, "relation": relations.get((state_id, successor))}
+            for successor in successors.get(state_id, ())
+        ]
 
-        # Evaluate if this state activates safe_mode
-        activates_safe_mode = False
-        try:
-            if self.G.has_node("safe_mode") and nx.has_path(self.G, state_id, "safe_mode"):
-                activates_safe_mode = True
-        except Exception:
-            pass 
+        # Evaluate if this state activates safe_mode (precomputed at load)
+        activates_safe_mode = state_id in safe_mode_ancestors
 
-        return {
+        result = {
             "current_state": state_id,
             "predicted_risks": risks,
             "activates_safe_mode": activates_safe_mode,
-            "reasoning_path": self._explain_reasoning(state_id)
+            "reasoning_path": list(explain.get(state_id, ()))
         }
+        return result
+
+    def _reload_if_changed(self):
+        """Reload the graph unless the file is unchanged since the last load."""
+        try:
+            if _file_stamp(self.kg_path) == self._loaded_stamp:
+                return
+        except FileNotFoundError:
+            pass
+        logger.info(f"Detected change in {self.kg_path}, reloading Knowledge Graph...")
+        self._load_knowledge_graph()
 
     def _explain_reasoning(self, start_node: str) -> List[str]:
-        """Generates a human-readable trace of the reasoning path."""
-        explanation = []
-        edges = list(nx.bfs_edges(self.G, start_node, depth_limit=2))
-        for u, v in edges:
-            rel = self.G.edges[u, v].get("relation", "leads to")
-            explanation.append(f"{u} --[{rel}]--> {v}")
-        return explanation
+        """Returns the human-readable trace of the reasoning path (precomputed at load)."""
+        return self._tables[3].get(start_node, [])
 
     # -------- AUTO-RELOAD ON FILE CHANGE --------
     class _GraphChangeHandler(FileSystemEventHandler):
-        """Internal handler to watch for JSON file modifications."""
+        """Internal handler to watch for JSON file modifications.
+        A save usually fires several events; they are debounced into a single reload."""
         def __init__(self, brain_instance):
             self.brain = brain_instance
+            self._timer = None
+            self._lock = Lock()
+
+        def _schedule_reload(self):
+            # Restart the quiet-period timer; only the last event of a burst triggers a reload
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer = Timer(RELOAD_DEBOUNCE, self.brain._reload_if_changed)
+                self._timer.daemon = True
+                self._timer.start()
 
         def on_modified(self, event):
             # Only reload the specific brain_graph.json
             if event.src_path.endswith("brain_graph.json"):
-                logger.info(f"Detected change in {event.src_path}, reloading Knowledge Graph...")
-                self.brain._load_knowledge_graph()
+                self._schedule_reload()
+
+        def on_moved(self, event):
+            # Atomic writers (temp file + os.replace) show up as a move onto brain_graph.json
+            if event.dest_path.endswith("brain_graph.json"):
+                self._schedule_reload()
 
     def _start_file_watcher(self):
         """Starts a background thread to monitor the JSON file for changes."""
@@ -160,4 +287,4 @@ if __name__ == "__main__":
     aquitari = AquitariBrain()
     print("\n--- [DEBUG] TESTING BRAIN DIAGNOSIS: 'low_rest' ---")
     result = aquitari.diagnose("low_rest")
-    print(json.dumps(result, indent=2))
+    print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
@@ -2,12 +2,12 @@
 AQUITARI CORE API - SERVER
 --------------------------
 Description:
-Primary gateway for the Aquitari Agent. Exposes a single POST endpoint
-to query the deterministic Knowledge Graph ('The Brain').
+Primary gateway for the Aquitari Agent. Exposes a POST endpoint (plus a
+batched variant) to query the deterministic Knowledge Graph ('The Brain').
 
 Key Features:
 - Asynchronous request handling via FastAPI.
-- Graph-based reasoning via NetworkX.
+- Graph-based reasoning via lookup tables precomputed when the graph loads.
 - Docker-compatible network binding (0.0.0.0).
 - Automatic OpenAPI documentation at /docs.
 
@@ -17,9 +17,14 @@ Year: 2026
 
 import uvicorn
 import logging
+import orjson
+import os
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import ORJSONResponse
 from time import time
+from pydantic import Field
+from typing import Annotated, List
 
 # Internal imports
 from logic import AquitariBrain
@@ -32,6 +37,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger("Aquitari_Server")
 
+# -------- SERVER CONFIG --------
+# Each worker process builds its own read-only brain; override with API_WORKERS=1 to debug
+API_WORKERS = int(os.getenv("API_WORKERS", min(4, os.cpu_count() or 1)))
+
+# 📦 Largest list accepted by /diagnose_batch (the whole body is built in one event-loop turn)
+MAX_DIAGNOSE_BATCH = int(os.getenv("MAX_DIAGNOSE_BATCH", 256))
+
+# Body of /diagnose_batch: oversized lists fail validation (422) instead of being diagnosed
+DiagnoseBatch = Annotated[List[DiagnoseRequest], Field(max_length=MAX_DIAGNOSE_BATCH)]
+
 # -------- LIFESPAN MANAGEMENT --------
 brain_instance = {}
 
@@ -50,11 +65,59 @@ app = FastAPI(
     title="Aquitari Local Core",
     description="The 'Brain' of the Aquitari Agent. Handles deterministic logic via Knowledge Graphs.",
     lifespan=lifespan,
-    version="1.1.0"
+    version="1.1.0",
+    default_response_class=ORJSONResponse
 )
 
+# -------- RESPONSE CACHE --------
+# Serialized diagnosis bytes per state, valid for one graph revision. Only the small
+# envelope (entity, state, timestamp) is serialized per request.
+_diagnosis_cache = {"revision": None, "by_state": {}}
+
+
+def _diagnosis_bytes(brain, state: str):
+    """Serialized diagnosis for state at the current graph revision, or None for unknown states."""
+    if _diagnosis_cache["revision"] != brain.revision:
+        _diagnosis_cache.update(revision=brain.revision, by_state={})
+    by_state = _diagnosis_cache["by_state"]
+    cached = by_state.get(state)
+    if cached is not None:
+        return cached
+
+    # Execute the Graph Search logic (lookups into tables precomputed at load, cheap enough for the event loop)
+    result = brain.diagnose(state)
+    if "error" in result:
+        return None
+    by_state[state] = orjson.dumps(result)
+    return by_state[state]
+
+
+# Diagnosis body returned for states that aren't in the Knowledge Graph
+_UNKNOWN_STATE_DIAGNOSIS = orjson.dumps({
+    "info": "No information available in the Knowledge Graph",
+    "status": "unknown_state"
+})
+
+
+def _diagnosis_body(entity, state: str, diagnosis: bytes) -> bytes:
+    """Splice cached diagnosis bytes into a freshly timestamped response object."""
+    return b"".join((
+        b'{"entity":', orjson.dumps(entity),
+        b',"state":', orjson.dumps(state),
+        b',"timestamp":', orjson.dumps(time()),
+        b',"diagnosis":', diagnosis,
+        b"}",
+    ))
+
+
+def _diagnosis_response(entity, state: str, diagnosis: bytes) -> Response:
+    """Single diagnosis as a raw JSON response."""
+    return Response(content=_diagnosis_body(entity, state, diagnosis), media_type="application/json")
+
+
 # -------- ENDPOINT --------
-@app.post("/diagnose", response_model=DiagnoseResponse, tags=["Reasoning"])
+# DiagnoseResponse documents the schema only; bodies are assembled from orjson bytes
+@app.post("/diagnose", responses={200: {"model": DiagnoseResponse}}, tags=["Reasoning"])
 async def run_diagnose(req: DiagnoseRequest):
     """
     Main Logic Endpoint:
@@ -68,30 +131,45 @@ async def run_diagnose(req: DiagnoseRequest):
     if not brain:
         raise HTTPException(status_code=503, detail="Brain engine is not initialized.")
 
-    # Execute the Graph Search logic
-    result = brain.diagnose(req.state)
+    diagnosis = _diagnosis_bytes(brain, req.state)
 
     # Graceful Handling: If the state doesn't exist in our JSON data
-    if "error" in result:
+    if diagnosis is None:
         logger.warning(f"Diagnosis failed: State '{req.state}' not found in Graph.")
-        return DiagnoseResponse(
-            entity=req.entity,
-            state=req.state,
-            timestamp=time(),
-            diagnosis={
-                "info": "No information available in the Knowledge Graph",
-                "status": "unknown_state"
-            }
-        )
+        return _diagnosis_response(req.entity, req.state, _UNKNOWN_STATE_DIAGNOSIS)
 
     logger.info(f"Diagnosis completed for {req.entity} in {round(time() - start_time, 4)}s")
 
-    return DiagnoseResponse(
-        entity=req.entity,
-        state=req.state,
-        timestamp=time(),
-        diagnosis=result
-    )
+    return _diagnosis_response(req.entity, req.state, diagnosis)
+
+
+@app.post("/diagnose_batch", responses={200: {"model": List[DiagnoseResponse]}}, tags=["Reasoning"])
+async def run_diagnose_batch(reqs: DiagnoseBatch):
+    """
+    Batched Logic Endpoint:
+    Same as /diagnose for a list of requests, answered in one round trip and in request order.
+    Each distinct state is diagnosed once; at most MAX_DIAGNOSE_BATCH requests per call.
+    """
+    start_time = time()
+    brain = brain_instance.get("core")
+
+    if not brain:
+        raise HTTPException(status_code=503, detail="Brain engine is not initialized.")
+
+    states = list(dict.fromkeys(req.state for req in reqs))
+    diagnoses = {state: _diagnosis_bytes(brain, state) for state in states}
+
+    items = []
+    for req in reqs:
+        diagnosis = diagnoses[req.state]
+        if diagnosis is None:
+            logger.warning(f"Diagnosis failed: State '{req.state}' not found in Graph.")
+            diagnosis = _UNKNOWN_STATE_DIAGNOSIS
+        items.append(_diagnosis_body(req.entity, req.state, diagnosis))
+
+    logger.info(f"Batch diagnosis completed for {len(reqs)} requests in {round(time() - start_time, 4)}s")
+
+    return Response(content=b"[" + b",".join(items) + b"]", media_type="application/json")
 
 # -------- RUNNER --------
 if __name__ == "__main__":
@@ -100,5 +178,8 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=False,
+        workers=API_WORKERS,
+        loop="auto",    # uvloop when installed (uvicorn[standard], not on Windows)
+        http="auto",    # httptools when installed
         log_level="info"
     )
\ No newline at end of file
@@ -10,24 +10,30 @@ Using Pydantic, it provides:
 File: app/models.py
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Dict, Any
-import json
+from functools import lru_cache
+import orjson
 import re
 
+# First-to-last brace span: the JSON object inside surrounding narrative text
+_JSON_RE = re.compile(r"\{.*\}", re.DOTALL)
+
 
 class DiagnoseRequest(BaseModel):
     """
     Schema for data entering the Brain from n8n or the Frontend.
     """
+    model_config = ConfigDict(extra="ignore")
+
     state: str = Field(
         ...,
-        example="low_rest",
+        examples=["low_rest"],
         description="The biological or system state ID from the Knowledge Graph (e.g., 'low_rest')."
     )
     entity: Optional[str] = Field(
         "local_user",
-        example="remad_01",
+        examples=["remad_01"],
         description="The identifier for the specific user, agent session, or hardware ID."
     )
 
@@ -50,14 +56,13 @@ class DiagnoseResponse(BaseModel):
     timestamp: float
     diagnosis: Dict[str, Any] = Field(
         ...,
-        description="The complete reasoning output from the NetworkX engine, including safe_mode status."
+        description="The complete reasoning output from the Brain's precomputed graph tables, including safe_mode status."
     )
 
-    class Config:
-        """
-        FastAPI Metadata configuration to provide realistic examples in the /docs endpoint.
-        """
-        json_schema_extra = {
+    # FastAPI metadata: realistic example for the /docs endpoint; frozen (responses are never mutated)
+    model_config = ConfigDict(
+        frozen=True,
+        json_schema_extra={
             "example": {
                 "entity": "remad_01",
                 "state": "low_rest",
@@ -71,7 +76,8 @@ class DiagnoseResponse(BaseModel):
                     "reasoning_path": ["low_rest --[TRIGGERS]--> executive_fatigue"]
                 }
             }
-        }
+        },
+    )
 
 
 # ---------------------------------------------------------
@@ -103,28 +109,39 @@ def extract_json_from_output(raw_output: Any) -> Dict[str, Any]:
     if isinstance(raw_output, dict):
         return raw_output
 
-    # ✅ Case 2: String that needs cleanup
+    # ✅ Case 2: String that needs cleanup (parsed once per distinct string; copy so callers can mutate)
     if isinstance(raw_output, str):
-        try:
-            cleaned = raw_output.strip()
-
-            # Remove fenced code blocks if present
-            if cleaned.startswith("```"):
-                lines = cleaned.splitlines()
-                cleaned = "\n".join(line for line in lines if not line.strip().startswith("```"))
-
-            # Use regex to find the first JSON object
-            match = re.search(r"\{.*\}", cleaned, re.DOTALL)
-            if match:
-                json_str = match.group(0)
-                try:
-                    return json.loads(json_str)
-                except Exception as e:
-                    print("JSON parse error:", e, "Raw after cleanup:", json_str)
-                    return {"reply": "I didn’t get it, please try again."}
-        except Exception as e:
-            print("Extractor error:", e)
+        return dict(_parse_json_text(raw_output))
 
     # ✅ Graceful fallback
     return {"reply": "I didn’t get it, please try again."}
-    return {}
\ No newline at end of file
+
+
+@lru_cache(maxsize=512)
+def _parse_json_text(raw_output: str) -> Dict[str, Any]:
+    """Clean and parse a raw agent string; cached, so the result must be treated as read-only."""
+    try:
+        cleaned = raw_output.strip()
+
+        # Remove fenced code blocks if present
+        if cleaned.startswith("```"):
+            lines = cleaned.splitlines()
+            cleaned = "\n".join(line for line in lines if not line.strip().startswith("```"))
+
+        # Fast path: the whole string is the object; otherwise use regex to find the first JSON object
+        if cleaned.startswith("{") and cleaned.endswith("}"):
+            json_str = cleaned
+        else:
+            match = _JSON_RE.search(cleaned)
+            json_str = match.group(0) if match else None
+        if json_str:
+            try:
+                return orjson.loads(json_str)
+            except Exception as e:
+                print("JSON parse error:", e, "Raw after cleanup:", json_str)
+                return {"reply": "I didn’t get it, please try again."}
+    except Exception as e:
+        print("Extractor error:", e)
+
+    # ✅ Graceful fallback
+    return {"reply": "I didn’t get it, please try again."}
\ No newline at end of file
@@ -2,23 +2,32 @@
 redis_feedback_graph_updater.py
 -------------------------------
 
-This script listens to a Redis Pub/Sub channel called 'feedback_channel' for agent feedback messages.
+This script consumes agent feedback messages from a Redis list called 'feedback_queue'.
 Each feedback message is expected to be a JSON object describing one or more actions to perform on a
 knowledge graph stored in a local JSON file (brain_graph.json). Supported actions include adding nodes,
-adding edges, updating nodes, deleting nodes, and deleting edges. The script ensures the graph file is
-always valid JSON by loading, modifying, and saving it safely.
+adding edges, updating nodes, deleting nodes, and deleting edges. The graph is loaded once and kept in
+memory; feedback is applied in place and flushed to disk at most once per second with an atomic
+write (temp file + os.replace), so the graph file is always valid JSON.
 
-⚠️ Note: This uses Redis Pub/Sub. Messages are delivered in real-time but are not stored if the script
-is offline. For guaranteed reliability, consider switching to a Redis list queue (RPUSH/BLPOP).
+Producers RPUSH feedback onto the list (the n8n Feedback_SubAgent's Redis node pushes to the tail of
+'feedback_queue'): messages wait there while the script is offline and are popped up to BATCH_MAX at a
+time (BLPOP, then LPOP with a count on Redis 6.2+, pipelined single LPOPs on older servers).
+
+⚠️ Note: Transition shim only: messages still published on the old Pub/Sub channel 'feedback_channel'
+(e.g. from a workflow export that predates the list queue) are forwarded onto the list while the script
+runs. Anything published there while it is offline is lost; re-import the workflow to get durability.
 
 Additionally:
-    After each modification, the script calls `graph_auto_linker.py` to enrich the graph by automatically
-    adding inferred edges between nodes based on semantic similarity.
+    After each flush, the script calls `graph_auto_linker.run()` to enrich the graph by automatically
+    adding inferred edges between nodes based on semantic similarity. Set AUTO_LINKER_SUBPROCESS=1
+    to run it as a separate `graph_auto_linker.py` process instead.
 """
 
 import redis
-import json
-import subprocess   # ✅ Used to call the auto-linker script
+import orjson
+import subprocess   # ✅ Used to call the auto-linker script when AUTO_LINKER_SUBPROCESS=1
+import threading
+import time
 import os
 from dotenv import load_dotenv
 
@@ -40,73 +49,134 @@ GRAPH_FILE = os.path.join(BASE_DIR, "data", "brain_graph.json")
 
 # 🔧 Path to the auto-linker script inside brain-api/app_scripts
 AUTO_LINKER_SCRIPT = os.path.join(BASE_DIR, "app_scripts", "graph_auto_linker.py")
+
+# 🔧 Run the auto-linker in a separate interpreter instead of in-process
+# (isolates its model memory, at the cost of a full interpreter + model start per flush)
+AUTO_LINKER_SUBPROCESS = os.getenv("AUTO_LINKER_SUBPROCESS", "0") == "1"
+
+# ⏱️ How often pending in-memory changes are flushed to disk (seconds)
+FLUSH_INTERVAL = 1.0
+
+# 📦 A feedback batch closes at BATCH_MAX messages or BATCH_WINDOW seconds after its first message
+BATCH_MAX = 64
+BATCH_WINDOW = 0.25
+
+# 📬 Durable feedback queue (Redis list) and the legacy Pub/Sub channel forwarded onto it
+FEEDBACK_QUEUE = "feedback_queue"
+FEEDBACK_CHANNEL = "feedback_channel"
+
+# 🗂️ Last graph read or written, tagged with the file's (mtime, size) at that moment
+_cached = {"stamp": None, "graph": None}
+
+
+def _file_stamp():
+    st = os.stat(GRAPH_FILE)
+    return (st.st_mtime_ns, st.st_size)
+
+
 def load_graph():
-    """Load the knowledge graph from disk. If invalid, return a fresh graph structure."""
+    """Load the knowledge graph from disk. If invalid, return a fresh graph structure.
+    If the file hasn't changed since this process last read or wrote it, the in-memory graph is reused."""
     try:
-        with open(GRAPH_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+        stamp = _file_stamp()
+        if stamp == _cached["stamp"] and _cached["graph"] is not None:
+            return _cached["graph"]
+        with open(GRAPH_FILE, "rb") as f:
+            graph = orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
         return {"nodes": [], "edges": []}
+    _cached.update(stamp=stamp, graph=graph)
+    return graph
 
 
 def save_graph(graph):
-    """Save the knowledge graph back to disk in valid JSON format with indentation."""
-    with open(GRAPH_FILE, "w", encoding="utf-8") as f:
-        json.dump(graph, f, indent=2, ensure_ascii=False)
-
-
-def apply_single_action(graph, feedback):
+    """Save the knowledge graph back to disk in valid JSON format with indentation.
+    Writes a temp file and swaps it in, so a crash never leaves a half-written graph."""
+    tmp = GRAPH_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(graph, option=orjson.OPT_INDENT_2))
+    os.replace(tmp, GRAPH_FILE)
+    # What's on disk is exactly this graph: the next load can skip the parse
+    _cached.update(stamp=_file_stamp(), graph=graph)
+
+
+def edge_key(edge):
+    """Identity of an edge: (source, target, relation)."""
+    return (edge.get("source"), edge.get("target"), edge.get("relation"))
+
+
+def build_index(graph):
+    """Index nodes by id and edges by (source, target, relation) so feedback actions are dict lookups
+    instead of list scans. "incident" maps each node id to the keys of the edges touching it.
+    The index is the source of truth; graph["nodes"] and graph["edges"] are rebuilt from it before saving."""
+    edges = {edge_key(e): e for e in graph.get("edges", [])}
+    incident = {}
+    for key in edges:
+        link_edge(incident, key)
+    return {
+        "nodes": {n["id"]: n for n in graph["nodes"]},
+        "edges": edges,
+        "incident": incident,
+    }
+
+
+def link_edge(incident, key):
+    """Record edge key under both of its endpoints."""
+    incident.setdefault(key[0], set()).add(key)
+    incident.setdefault(key[1], set()).add(key)
+
+
+def unlink_edge(incident, key):
+    """Forget edge key under both of its endpoints."""
+    for node_id in (key[0], key[1]):
+        keys = incident.get(node_id)
+        if keys is not None:
+            keys.discard(key)
+
+
+def apply_single_action(graph, feedback, index):
     """Apply a single feedback action to the graph."""
     action = feedback.get("action")
+    nodes = index["nodes"]
+    edges = index["edges"]
 
     if action == "add_node" and "node" in feedback:
         node = feedback["node"]
-        if not any(n["id"] == node["id"] for n in graph["nodes"]):
-            graph["nodes"].append(node)
+        if node["id"] not in nodes:
+            nodes[node["id"]] = node
             print(f"🟢 Node added: {node['id']}")
 
     elif action == "add_edge" and "edge" in feedback:
         edge = feedback["edge"]
-        sources = [n["id"] for n in graph["nodes"]]
-        if edge["source"] in sources and edge["target"] in sources:
-            if not any(
-                e.get("source") == edge["source"] and
-                e.get("target") == edge["target"] and
-                e.get("relation") == edge["relation"]
-                for e in graph["edges"]
-            ):
-                graph["edges"].append(edge)
+        if edge["source"] in nodes and edge["target"] in nodes:
+            key = (edge["source"], edge["target"], edge["relation"])
+            if key not in edges:
+                edges[key] = edge
+                link_edge(index["incident"], key)
                 print(f"🔗 Edge added: {edge['source']} → {edge['target']} ({edge['relation']})")
         else:
             print(f"⚠️ Edge skipped (missing nodes): {edge}")
 
     elif action == "update_node" and "node" in feedback:
-        for n in graph["nodes"]:
-            if n["id"] == feedback["node"]["id"]:
-                n.update(feedback["node"])
-                print(f"✏️ Node updated: {n['id']}")
+        n = nodes.get(feedback["node"]["id"])
+        if n is not None:
+            n.update(feedback["node"])
+            print(f"✏️ Node updated: {n['id']}")
 
     elif action == "delete_node" and "node" in feedback:
         node_id = feedback["node"]["id"]
-        graph["nodes"] = [n for n in graph["nodes"] if n["id"] != node_id]
-        graph["edges"] = [
-            e for e in graph["edges"]
-            if e.get("source") != node_id and e.get("target") != node_id
-        ]
+        nodes.pop(node_id, None)
+        # Only the edges touching this node, instead of a scan over every edge
+        for key in index["incident"].pop(node_id, ()):
+            edges.pop(key, None)
+            unlink_edge(index["incident"], key)
         print(f"🗑️ Node deleted: {node_id}")
 
     elif action == "delete_edge" and "edge" in feedback:
         edge = feedback["edge"]
-        before = len(graph["edges"])
-        graph["edges"] = [
-            e for e in graph["edges"]
-            if not (
-                e.get("source") == edge.get("source") and
-                e.get("target") == edge.get("target") and
-                e.get("relation") == edge.get("relation")
-            )
-        ]
-        if len(graph["edges"]) < before:
+        key = edge_key(edge)
+        if edges.pop(key, None) is not None:
+            unlink_edge(index["incident"], key)
             print(f"🗑️ Edge deleted: {edge['source']} → {edge['target']} ({edge['relation']})")
         else:
             print(f"⚠️ Edge not found for deletion: {edge}")
@@ -114,58 +184,141 @@ def apply_single_action(graph, feedback):
     return graph
 
 
-def apply_feedback(graph, feedback):
+def apply_feedback(graph, feedback, index):
     """Apply feedback to the graph (single or grouped actions)."""
     if "actions" in feedback and isinstance(feedback["actions"], list):
         for action_item in feedback["actions"]:
             try:
-                graph = apply_single_action(graph, action_item)
+                graph = apply_single_action(graph, action_item, index)
             except Exception as e:
                 print(f"⚠️ Failed action: {action_item} → {e}")
     else:
         try:
-            graph = apply_single_action(graph, feedback)
+            graph = apply_single_action(graph, feedback, index)
         except Exception as e:
             print(f"⚠️ Failed action: {feedback} → {e}")
     return graph
 
 
 def run_auto_linker():
-    """Call the auto-linker script to enrich the graph."""
+    """Call the auto-linker to enrich the graph.
+    Runs in-process by default, so the embedding model and relation cache stay loaded between flushes."""
     try:
-        subprocess.run(["python", AUTO_LINKER_SCRIPT], check=True)
+        if AUTO_LINKER_SUBPROCESS:
+            subprocess.run(["python", AUTO_LINKER_SCRIPT], check=True)
+        else:
+            # Imported lazily: loading the module loads the embedding model
+            from graph_auto_linker import run as run_auto_linker_impl
+            run_auto_linker_impl(GRAPH_FILE)
         print("🤖 Auto-linker executed successfully.")
     except Exception as e:
         print(f"⚠️ Auto-linker failed: {e}")
 
 
+def save_state(state):
+    """Rebuild the node and edge lists from the index and save the in-memory graph."""
+    state["graph"]["nodes"] = list(state["index"]["nodes"].values())
+    state["graph"]["edges"] = list(state["index"]["edges"].values())
+    save_graph(state["graph"])
+    state["dirty"] = False
+
+
+def flush_graph(state):
+    """Persist the in-memory graph if it changed, then run the auto-linker and reload its edges."""
+    if not state["dirty"]:
+        return
+    save_state(state)
+    print("✅ Graph file updated.")
+
+    # 🔧 Call auto-linker after every flush, then pick up the edges it wrote
+    run_auto_linker()
+    state["graph"] = load_graph()
+    state["index"] = build_index(state["graph"])
+
+
+def flush_loop(state, lock):
+    """Background thread: flush pending changes every FLUSH_INTERVAL seconds."""
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        with lock:
+            flush_graph(state)
+
+
+def pop_queued(r, count, lpop_count):
+    """Pop up to count queued messages in one round trip.
+    LPOP with a count needs Redis 6.2+; on older servers (ResponseError) fall back to pipelined single LPOPs."""
+    if lpop_count["supported"]:
+        try:
+            return r.lpop(FEEDBACK_QUEUE, count=count) or []
+        except redis.ResponseError:
+            print("⚠️ Redis < 6.2: LPOP with a count is unsupported, falling back to single LPOPs")
+            lpop_count["supported"] = False
+    pipe = r.pipeline(transaction=False)
+    for _ in range(count):
+        pipe.lpop(FEEDBACK_QUEUE)
+    return [data for data in pipe.execute() if data is not None]
+
+
 def listen_feedback():
-    """Listen to Redis channel and apply feedback messages continuously."""
+    """Consume the Redis feedback queue and apply feedback messages continuously."""
         # ✅ Create Redis client using variables
     r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
 
     # 👇 Debug: check if Redis settings are loaded correctly
     print(f"Redis connected to {REDIS_HOST}:{REDIS_PORT}, DB={REDIS_DB}")
 
-    pubsub = r.pubsub()
-    pubsub.subscribe("feedback_channel")
+    # 🔁 Transition shim: forward anything still published on the old channel onto the queue
+    pubsub = r.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(**{FEEDBACK_CHANNEL: lambda message: r.rpush(FEEDBACK_QUEUE, message["data"])})
+    pubsub.run_in_thread(sleep_time=0.1, daemon=True)
 
-    print("🚀 Listening on Redis channel: feedback_channel")
+    print(f"🚀 Listening on Redis queue: {FEEDBACK_QUEUE} (forwarding channel {FEEDBACK_CHANNEL})")
 
-    for message in pubsub.listen():
-        if message["type"] == "message":
-            try:
-                feedback = json.loads(message["data"])
-                graph = load_graph()
-                graph = apply_feedback(graph, feedback)
-                save_graph(graph)
-                print("✅ Graph file updated.")
+    # ✅ Load the graph once; feedback is applied in memory and flushed in the background
+    graph = load_graph()
+    state = {"graph": graph, "index": build_index(graph), "dirty": False}
+    lock = threading.Lock()
+    threading.Thread(target=flush_loop, args=(state, lock), daemon=True).start()
+    lpop_count = {"supported": True}
 
-                # 🔧 Call auto-linker after every modification
-                run_auto_linker()
-
-            except Exception as e:
-                print("⚠️ Invalid feedback:", e)
+    try:
+        while True:
+            # Block for the first message, then keep collecting until the batch is full or its window closes
+            item = r.blpop(FEEDBACK_QUEUE, timeout=1)
+            if item is None:
+                continue
+            batch = [item[1]]
+            deadline = time.monotonic() + BATCH_WINDOW
+            while len(batch) < BATCH_MAX:
+                # Take everything already queued in one round trip
+                queued = pop_queued(r, BATCH_MAX - len(batch), lpop_count)
+                if queued:
+                    batch.extend(queued)
+                    continue
+                # Queue is empty: wait out the rest of the window for stragglers
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                item = r.blpop(FEEDBACK_QUEUE, timeout=remaining)
+                if item is None:
+                    break
+                batch.append(item[1])
+
+            # Apply the whole batch under one lock; the flush thread persists it once
+            with lock:
+                for data in batch:
+                    try:
+                        feedback = orjson.loads(data)
+                        state["graph"] = apply_feedback(state["graph"], feedback, state["index"])
+                        state["dirty"] = True
+
+                    except Exception as e:
+                        print("⚠️ Invalid feedback:", e)
+    finally:
+        # Don't lose changes that arrived after the last flush
+        with lock:
+            if state["dirty"]:
+                save_state(state)
 
 
 if __name__ == "__main__":
@@ -6,42 +6,102 @@ This script starts all required components of the Aquitari agent project:
 - app.py (API / web application layer)
 - redis_feedback_graph_updater.py (Redis listener for knowledge graph updates)
 
-It ensures all scripts run in parallel as separate processes. Paths are defined
-relative to the project root, so the project runs correctly on any machine.
+It runs all scripts in parallel as separate processes under a small asyncio supervisor:
+all services are spawned at once, a service that crashes is restarted, and stopping
+(CTRL+C / SIGTERM) terminates every service, killing any that ignore it after STOP_TIMEOUT.
+Paths are defined relative to this file, so the project runs correctly on any machine.
 """
 
+import asyncio
+import signal
 import sys
-import subprocess
 from pathlib import Path
 
-# ✅ Get the root folder of the project (move up from app_scripts if needed)
+# ✅ Folder containing this script and the services it starts (app_scripts)
 BASE_DIR = Path(__file__).resolve().parent
 
 # ✅ Define paths relative to BASE_DIR
 MAIN_PATH = BASE_DIR / "main.py"
 APP_PATH = BASE_DIR / "app.py"
-REDIS_UPDATER_PATH = BASE_DIR / "app_scripts" / "redis_feedback_graph_updater.py"
+REDIS_UPDATER_PATH = BASE_DIR / "redis_feedback_graph_updater.py"
+SERVICES = [MAIN_PATH, APP_PATH, REDIS_UPDATER_PATH]
 
-def run_script(path: Path):
+# ⏱️ Grace period between terminate and kill when stopping (seconds)
+STOP_TIMEOUT = 10.0
+
+# ⏱️ Pause before restarting a service that crashed (seconds)
+RESTART_DELAY = 2.0
+
+
+async def run_script(path: Path):
     """Run a Python script as a separate process."""
-    return subprocess.Popen([sys.executable, str(path)])
+    return await asyncio.create_subprocess_exec(sys.executable, str(path))
 
-if __name__ == "__main__":
+
+async def supervise(path: Path, procs, stopping: asyncio.Event):
+    """Watch one service: restart it after a crash, leave it down after a clean exit."""
+    while True:
+        code = await procs[path].wait()
+        if stopping.is_set():
+            return
+        if code == 0:
+            print(f"ℹ️ {path.name} exited.")
+            return
+        print(f"⚠️ {path.name} crashed (exit code {code}), restarting in {RESTART_DELAY:g}s...")
+        await asyncio.sleep(RESTART_DELAY)
+        if stopping.is_set():
+            return
+        procs[path] = await run_script(path)
+
+
+async def stop_all(procs):
+    """Terminate every running service, then kill any still alive after STOP_TIMEOUT."""
+    running = {path: proc for path, proc in procs.items() if proc.returncode is None}
+    for proc in running.values():
+        proc.terminate()
+    try:
+        await asyncio.wait_for(asyncio.gather(*(p.wait() for p in running.values())), STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        for path, proc in running.items():
+            if proc.returncode is None:
+                print(f"🔪 {path.name} did not stop in {STOP_TIMEOUT:g}s, killing it.")
+                proc.kill()
+        await asyncio.gather(*(p.wait() for p in running.values()))
+
+
+async def main():
     print("🚀 Starting all services...")
 
-    main_proc = run_script(MAIN_PATH)
-    app_proc = run_script(APP_PATH)
-    redis_proc = run_script(REDIS_UPDATER_PATH)
+    # Spawn every service at once instead of one after another
+    procs = dict(zip(SERVICES, await asyncio.gather(*(run_script(path) for path in SERVICES))))
+
+    # Stop on CTRL+C / SIGTERM (on Windows, CTRL+C arrives as KeyboardInterrupt instead)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            pass
 
     print("✅ All services started (main.py, app.py, redis_feedback_graph_updater.py).")
     print("⚠️ Press CTRL+C to stop all services.")
 
+    watchers = asyncio.gather(*(supervise(path, procs, stopping) for path in SERVICES))
+    stop_requested = asyncio.ensure_future(stopping.wait())
     try:
-        main_proc.wait()
-        app_proc.wait()
-        redis_proc.wait()
-    except KeyboardInterrupt:
+        # Run until every service has exited cleanly or a stop is requested
+        await asyncio.wait([watchers, stop_requested], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopping.set()
         print("\n🛑 Stopping all services...")
-        main_proc.terminate()
-        app_proc.terminate()
-        redis_proc.terminate()
\ No newline at end of file
+        await stop_all(procs)
+        watchers.cancel()
+        stop_requested.cancel()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -1,93 +1,116 @@
 # visualize_kg.py
-import json
+import argparse
+import hashlib
+import orjson
 import os
+import pickle
 import networkx as nx
+import matplotlib
+
+# -------- CLI --------
+parser = argparse.ArgumentParser(description="Render the knowledge graph to knowledge_graph.png")
+parser.add_argument("--show", action="store_true", help="also open an interactive window")
+args = parser.parse_args()
+
+# Headless runs skip GUI backend initialization entirely
+if not args.show:
+    matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
 # -------- CONFIG --------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 KG_FILE = os.path.join(BASE_DIR, "brain_graph.json")  # knowledge graph JSON
+LAYOUT_CACHE = os.path.join(BASE_DIR, "knowledge_graph_layout.pkl")  # cached node positions
+MAX_EDGE_LABELS = 100  # above this, edge labels are skipped (one Text artist per label is slow)
+
+# Node colors by type (anything else is drawn gray)
+TYPE_COLORS = {
+    "system_state": "orange",
+    "physiological_marker": "lightcoral",
+    "cognitive_condition": "gold",
+    "behavioral_risk": "red",
+    "protection_state": "lightgreen",
+    "system_metric": "skyblue",
+}
 
 # -------- LOAD KNOWLEDGE GRAPH --------
-with open(KG_FILE, "r", encoding="utf-8") as f:
-    kg = json.load(f)
+with open(KG_FILE, "rb") as f:
+    kg = orjson.loads(f.read())
 
 # -------- CREATE GRAPH --------
 G = nx.DiGraph()
 
 # Add nodes
-for node in kg.get("nodes", []):
-    G.add_node(node["id"], type=node.get("type", ""))
+G.add_nodes_from((node["id"], {"type": node.get("type", "")}) for node in kg.get("nodes", []))
 
 # Add edges
-for edge in kg.get("edges", []):
-    G.add_edge(
-        edge["source"],
-        edge["target"],
-        relation=edge.get("relation", "")
-    )
+G.add_edges_from(
+    (edge["source"], edge["target"], {"relation": edge.get("relation", "")})
+    for edge in kg.get("edges", [])
+)
 
 # -------- DRAW GRAPH --------
+# Faster path rendering for the high-dpi PNG export
+plt.rcParams["path.simplify"] = True
+plt.rcParams["agg.path.chunksize"] = 10000
+
 plt.figure(figsize=(12, 8))
 
-# Layout
-pos = nx.spring_layout(G, seed=42)
+# Layout (cached on disk, keyed by the graph structure)
+layout_key = hashlib.sha1(
+    orjson.dumps([sorted(G.nodes()), sorted(G.edges())])
+).hexdigest()
 
-# Color nodes by type
-color_map = []
-for _, data in G.nodes(data=True):
-    node_type = data.get("type", "")
-    if node_type == "system_state":
-        color_map.append("orange")
-    elif node_type == "physiological_marker":
-        color_map.append("lightcoral")
-    elif node_type == "cognitive_condition":
-        color_map.append("gold")
-    elif node_type == "behavioral_risk":
-        color_map.append("red")
-    elif node_type == "protection_state":
-        color_map.append("lightgreen")
-    elif node_type == "system_metric":
-        color_map.append("skyblue")
+cached = {}
+if os.path.exists(LAYOUT_CACHE):
+    try:
+        with open(LAYOUT_CACHE, "rb") as f:
+            cached = pickle.load(f)
+    except (pickle.UnpicklingError, EOFError):
+        cached = {}
+
+if cached.get("key") == layout_key:
+    pos = cached["pos"]
+else:
+    # Warm-start from the previous positions so small graph edits converge quickly
+    seed_pos = {n: p for n, p in cached.get("pos", {}).items() if n in G}
+    if seed_pos:
+        pos = nx.spring_layout(G, pos=seed_pos, seed=42, iterations=30)
     else:
-        color_map.append("gray")
+        pos = nx.spring_layout(G, seed=42)
+    with open(LAYOUT_CACHE, "wb") as f:
+        pickle.dump({"key": layout_key, "pos": pos}, f)
 
-# Draw nodes
-nx.draw_networkx_nodes(
+# Color nodes by type
+color_map = [TYPE_COLORS.get(data.get("type", ""), "gray") for _, data in G.nodes(data=True)]
+
+# Draw nodes, edges and node labels in one call
+nx.draw_networkx(
     G,
     pos,
     node_color=color_map,
     node_size=1400,
-    alpha=0.9
-)
-
-# Draw edges
-nx.draw_networkx_edges(
-    G,
-    pos,
+    alpha=0.9,
     arrowstyle="->",
     arrowsize=20,
     edge_color="black",
-    width=2
-)
-
-# Node labels
-nx.draw_networkx_labels(
-    G,
-    pos,
+    width=2,
     font_size=10,
     font_weight="bold"
 )
 
-# Edge labels
-edge_labels = nx.get_edge_attributes(G, "relation")
-nx.draw_networkx_edge_labels(
-    G,
-    pos,
-    edge_labels=edge_labels,
-    font_color="darkred",
-    font_size=9
-)
+# Edge labels (only non-empty relations, and only while the graph is readable)
+edge_labels = {(u, v): rel for u, v, rel in G.edges(data="relation") if rel}
+if len(edge_labels) <= MAX_EDGE_LABELS:
+    nx.draw_networkx_edge_labels(
+        G,
+        pos,
+        edge_labels=edge_labels,
+        font_color="darkred",
+        font_size=9
+    )
+else:
+    print(f"Skipping edge labels: {len(edge_labels)} labeled edges (limit {MAX_EDGE_LABELS}).")
 
 plt.title("Knowledge Graph Visualization", fontsize=14)
 plt.axis("off")
@@ -96,6 +119,7 @@ plt.tight_layout()
 # -------- SAVE & SHOW --------
 output_path = os.path.join(BASE_DIR, "knowledge_graph.png")
 plt.savefig(output_path, dpi=300)
-plt.show()
+if args.show:
+    plt.show()
 
 print(f"Graph saved to: {output_path}")